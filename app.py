@@ -2,91 +2,295 @@
 from flask import Flask, request, render_template, redirect
 from markupsafe import escape
 import sqlite3
-from datetime import datetime
-import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from xml.sax.saxutils import escape as xml_escape
 import os
+import atexit
+import hashlib
+import html
+import queue
+import threading
+import time
 from contextlib import contextmanager
 
 app = Flask(__name__)
+# 模板编译后常驻内存，不在每次渲染时检查文件变化
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+
+# SQL语句常量，每次使用相同的字符串以命中连接的预编译语句缓存
+_SQL_LIST_POSTS = 'SELECT * FROM posts ORDER BY id DESC'
+_SQL_LIST_POSTS_LIMIT = 'SELECT * FROM posts ORDER BY id DESC LIMIT ?'
+_SQL_RSS_POSTS = ('SELECT id, title, content, created_at FROM posts '
+                  'ORDER BY id DESC LIMIT ?')
+_SQL_GET_POST = 'SELECT * FROM posts WHERE id = ?'
+_SQL_REVISION = 'SELECT revision FROM posts_revision'
+_SQL_FEED_STATE = 'SELECT revision, modified_at FROM posts_revision'
+_SQL_INSERT_POST = 'INSERT INTO posts (title, content, created_at) VALUES (?, ?, ?)'
+_SQL_UPDATE_POST = 'UPDATE posts SET title = ?, content = ? WHERE id = ?'
+_SQL_DELETE_POST = 'DELETE FROM posts WHERE id = ?'
 
 class Database:
     def __init__(self):
         self.db_file = 'posts.db'
-        
+        # 有上限的连接池，连接在请求间复用以保留SQLite的页缓存
+        self._pool = queue.LifoQueue(maxsize=8)
+        # 首次建立连接时检查并升级表结构，不依赖启动入口
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def _connect(self):
+        """创建新连接并设置连接级参数"""
+        # 自动提交模式，写操作显式开启事务；连接长期复用，预编译语句得以保留
+        # 连接会在线程间传递，但同一时刻只被一个线程使用
+        conn = sqlite3.connect(self.db_file, cached_statements=256,
+                               isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')
+        # 通过内存映射读取数据库文件，减少读操作的系统调用
+        conn.execute('PRAGMA mmap_size=268435456')
+        try:
+            self._ensure_schema(conn)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _ensure_schema(self, conn):
+        """每个进程只初始化一次表结构"""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                self._init_schema(conn)
+                self._schema_ready = True
+
+    def _release(self, conn):
+        """归还连接，池已满时直接关闭"""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        """关闭连接池中的所有连接"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
     @contextmanager
     def get_connection(self):
         try:
-            conn = sqlite3.connect(self.db_file)
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
             try:
                 yield conn
             finally:
-                conn.close()
+                # 连接会被复用，归还前回滚未提交的事务
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                except sqlite3.Error:
+                    conn.close()
+                else:
+                    self._release(conn)
         except sqlite3.Error as e:
             print(f"数据库错误: {e}")
             raise
     
     def init_db(self):
         """初始化数据库"""
-        with self.get_connection() as conn:
+        # 建立连接时即会检查表结构，这里在启动时提前完成
+        with self.get_connection():
+            pass
+
+    def _init_schema(self, conn):
+        """创建表并升级旧版本的表结构"""
+        # 多个进程同时启动时，由写锁保证只有一个进程执行升级
+        conn.execute('BEGIN IMMEDIATE')
+        try:
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS posts (
                     id INTEGER PRIMARY KEY,
                     title TEXT,
                     content TEXT,
-                    created_at TEXT
+                    created_at INTEGER
                 )
             ''')
+            self._migrate_created_at(conn)
+            self._unescape_legacy_text(conn)
+            self._create_revision(conn)
             conn.commit()
-    
+        except BaseException:
+            conn.rollback()
+            raise
+        # WAL模式持久保存在数据库文件中，读写互不阻塞
+        if self.db_file != ':memory:':
+            conn.execute('PRAGMA journal_mode=WAL')
+
+    def _migrate_created_at(self, conn):
+        """将旧版本的ISO时间字符串转换为Unix时间戳"""
+        columns = {row[1]: row[2] for row in conn.execute('PRAGMA table_info(posts)')}
+        if columns.get('created_at', '').upper() != 'TEXT':
+            return
+        # 列类型无法直接修改，需要重建表；旧数据保存的是本地时间，
+        # 也可能已有以文本形式保存的时间戳
+        conn.execute('''
+            CREATE TABLE posts_new (
+                id INTEGER PRIMARY KEY,
+                title TEXT,
+                content TEXT,
+                created_at INTEGER
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO posts_new (id, title, content, created_at)
+            SELECT id, title, content,
+                   CASE WHEN created_at GLOB '[0-9]*'
+                             AND NOT created_at GLOB '*[^0-9]*'
+                        THEN CAST(created_at AS INTEGER)
+                        ELSE CAST(strftime('%s', created_at, 'utc') AS INTEGER)
+                   END
+            FROM posts
+        ''')
+        conn.execute('DROP TABLE posts')
+        conn.execute('ALTER TABLE posts_new RENAME TO posts')
+
+    def _unescape_legacy_text(self, conn):
+        """旧版本写入前对标题和内容做了HTML转义，一次性还原为原文"""
+        # user_version记录是否已还原，避免把原文中的实体再次还原
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= 1:
+            return
+        rows = conn.execute('SELECT id, title, content FROM posts').fetchall()
+        conn.executemany(
+            'UPDATE posts SET title = ?, content = ? WHERE id = ?',
+            [(html.unescape(title) if title is not None else None,
+              html.unescape(content) if content is not None else None,
+              post_id)
+             for post_id, title, content in rows]
+        )
+        conn.execute('PRAGMA user_version = 1')
+
+    def _create_revision(self, conn):
+        """创建文章修订号，由触发器在任何写入时递增"""
+        # 修订号保存在数据库中，其他进程或直接修改数据库也能使缓存失效
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS posts_revision (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                revision INTEGER NOT NULL,
+                modified_at INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO posts_revision (id, revision, modified_at)
+            VALUES (0, 0, CAST(strftime('%s', 'now') AS INTEGER))
+        ''')
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS posts_revision_{event.lower()}
+                AFTER {event} ON posts
+                BEGIN
+                    UPDATE posts_revision
+                    SET revision = revision + 1,
+                        modified_at = CAST(strftime('%s', 'now') AS INTEGER);
+                END
+            ''')
+
     def get_posts(self, limit=None):
         """获取文章列表"""
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            query = 'SELECT * FROM posts ORDER BY id DESC'
             if limit:
                 # 使用参数化查询防止SQL注入
-                return conn.execute(query + ' LIMIT ?', (limit,)).fetchall()
-            return conn.execute(query).fetchall()
+                return conn.execute(_SQL_LIST_POSTS_LIMIT, (limit,)).fetchall()
+            return conn.execute(_SQL_LIST_POSTS).fetchall()
     
+    def get_posts_for_rss(self, limit):
+        """获取RSS所需的文章字段，逐行生成以免构建中间列表"""
+        # 遍历期间保持在连接上下文内，读取出错时同样回滚并记录
+        with self.get_connection() as conn:
+            # 返回普通元组，按列顺序解包比按键名访问更快
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            yield from cursor.execute(_SQL_RSS_POSTS, (limit,))
+
     def add_post(self, title, content):
         """添加新文章"""
         with self.get_connection() as conn:
+            # 开始时即获取写锁，避免执行后才发生锁冲突
+            conn.execute('BEGIN IMMEDIATE')
             conn.execute(
-                'INSERT INTO posts (title, content, created_at) VALUES (?, ?, ?)',
-                (escape(title), escape(content), datetime.now().isoformat())
+                _SQL_INSERT_POST,
+                (title, content, int(time.time()))
             )
             conn.commit()
 
     def get_post_by_id(self, post_id):
         """根据ID获取文章"""
         with self.get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(
-                'SELECT * FROM posts WHERE id = ?', 
-                (post_id,)
-            )
+            cursor = conn.execute(_SQL_GET_POST, (post_id,))
             return cursor.fetchone()
 
-    def update_post(self, post_id, title, content):
+    def update_post(self, post_id: int, title, content):
         """更新文章"""
         with self.get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
             conn.execute(
-                'UPDATE posts SET title = ?, content = ? WHERE id = ?',
-                (escape(title), escape(content), post_id)
+                _SQL_UPDATE_POST,
+                (title, content, post_id)
             )
             conn.commit()
 
-    def delete_post(self, post_id):
+    def delete_post(self, post_id: int):
         """删除文章"""
         with self.get_connection() as conn:
-            conn.execute(
-                'DELETE FROM posts WHERE id = ?',
-                (post_id,)
-            )
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(_SQL_DELETE_POST, (post_id,))
             conn.commit()
 
+    def get_revision(self):
+        """获取文章修订号"""
+        with self.get_connection() as conn:
+            return conn.execute(_SQL_REVISION).fetchone()[0]
+
+    def get_feed_state(self):
+        """获取文章修订号和最近修改时间"""
+        with self.get_connection() as conn:
+            return tuple(conn.execute(_SQL_FEED_STATE).fetchone())
+
 db = Database()
 
+# RSS输出缓存: (缓存键, XML内容, ETag)
+_rss_cache = {'entry': None}
+# 首页输出缓存: (缓存键, HTML内容, ETag)
+_index_cache = {'entry': None}
+
+def _from_timestamp(ts):
+    """将数据库中的Unix时间戳转换为UTC时间，为空或无效时返回None"""
+    # 表结构在首次连接时已升级，旧的时间字符串不会出现在这里
+    try:
+        return datetime.fromtimestamp(ts, timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+@app.template_filter('datetime')
+def format_timestamp(ts):
+    """模板中以本地时间显示发布时间"""
+    dt = _from_timestamp(ts)
+    if dt is None:
+        return ''
+    return dt.astimezone().strftime('%Y-%m-%d %H:%M:%S')
+
 @app.errorhandler(500)
 def internal_error(error):
     return "服务器内部错误", 500
@@ -137,6 +341,11 @@ def save_post():
             return "内容过长", 400
             
         if post_id and post_id != 'None':
+            # 以整数绑定，直接按rowid查找
+            try:
+                post_id = int(post_id)
+            except ValueError:
+                return "文章ID无效", 400
             db.update_post(post_id, title, content)
         else:
             db.add_post(title, content)
@@ -160,13 +369,25 @@ def delete_post(post_id):
 def index():
     """集成页面主入口"""
     try:
-        posts = db.get_posts()
-        return render_template('integrated.html', 
-                            posts=posts,
-                            edit_mode=False,
-                            post_id=None,
-                            title='',
-                            content='')
+        # 文章未变化时直接复用上次渲染的页面
+        key = (request.script_root, db.get_revision())
+        entry = _index_cache['entry']
+        if entry is None or entry[0] != key:
+            posts = db.get_posts()
+            html = render_template('integrated.html',
+                                posts=posts,
+                                edit_mode=False,
+                                post_id=None,
+                                title='',
+                                content='')
+            etag = hashlib.md5(html.encode('utf-8')).hexdigest()
+            entry = _index_cache['entry'] = (key, html, etag)
+
+        response = app.response_class(entry[1], mimetype='text/html')
+        # 每次都向服务器验证ETag，保证保存或删除后立即看到最新列表
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.set_etag(entry[2])
+        return response.make_conditional(request)
     except Exception as e:
         print(f"首页错误: {e}")
         return redirect('/error')
@@ -174,31 +395,66 @@ def index():
 @app.route('/rss')
 def rss_feed():
     """生成RSS订阅"""
-    posts = db.get_posts(20)
-    
-    # 生成符合RSS 2.0规范的XML
-    rss = ET.Element('rss', version='2.0')
-    channel = ET.SubElement(rss, 'channel')
-    ET.SubElement(channel, 'title').text = "我的推文"
-    ET.SubElement(channel, 'link').text = request.url_root
-    ET.SubElement(channel, 'description').text = "我的最新推文更新"
-    ET.SubElement(channel, 'lastBuildDate').text = datetime.now().isoformat()
-    
-    for post in posts:
-        item = ET.SubElement(channel, 'item')
-        ET.SubElement(item, 'title').text = post['title']
-        ET.SubElement(item, 'description').text = post['content']
-        ET.SubElement(item, 'pubDate').text = post['created_at']
-        ET.SubElement(item, 'guid').text = f"{request.url_root}post/{post['id']}"
-        ET.SubElement(item, 'link').text = f"{request.url_root}post/{post['id']}"
-    
-    # 添加XML声明和正确的内容类型
+    revision, modified_at = db.get_feed_state()
+    # 文章未变化时直接复用上次生成的XML
+    key = (request.url_root, revision)
+    entry = _rss_cache['entry']
+    if entry is None or entry[0] != key:
+        posts = db.get_posts_for_rss(20)
+
+        # 直接拼接字符串生成符合RSS 2.0规范的XML，避免构建完整的元素树
+        root = xml_escape(request.url_root)
+        parts = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<rss version="2.0"><channel>',
+            '<title>我的推文</title>',
+            f'<link>{root}</link>',
+            '<description>我的最新推文更新</description>',
+        ]
+        # lastBuildDate取最新文章的发布时间，遍历完成后再插入到频道信息之后
+        build_index = len(parts)
+        latest = None
+
+        post_root = root + 'post/'
+        for post_id, title, content, created_at in posts:
+            # guid与link相同，只拼接一次
+            link = post_root + str(post_id)
+            pub_dt = _from_timestamp(created_at)
+            if pub_dt is not None and (latest is None or pub_dt > latest):
+                latest = pub_dt
+            pub_date = '' if pub_dt is None else format_datetime(pub_dt, usegmt=True)
+            parts.append(
+                f"<item><title>{xml_escape(title)}</title>"
+                # 阅读器会把description当作HTML解析，先转义一次再按XML转义
+                f"<description>{xml_escape(str(escape(content)))}</description>"
+                f"<pubDate>{pub_date}</pubDate>"
+                f"<guid>{link}</guid>"
+                f"<link>{link}</link></item>"
+            )
+        parts.append('</channel></rss>')
+        if latest is not None:
+            build_date = format_datetime(latest, usegmt=True)
+            parts.insert(build_index, f'<lastBuildDate>{build_date}</lastBuildDate>')
+
+        body = ''.join(parts)
+        etag = hashlib.md5(body.encode('utf-8')).hexdigest()
+        entry = _rss_cache['entry'] = (key, body, etag)
+
+    # 设置正确的内容类型
     response = app.response_class(
-        ET.tostring(rss, encoding='unicode'),
+        entry[1],
         mimetype='application/rss+xml'
     )
-    return response
+    # 客户端携带相同ETag或未过期的If-Modified-Since时返回304
+    response.set_etag(entry[2])
+    # 编辑和删除不改变发布时间，因此使用数据库记录的最近一次写入时间
+    response.last_modified = _from_timestamp(modified_at)
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
     db.init_db()
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # 启动时预编译模板
+    for name in ('editor.html', 'integrated.html'):
+        app.jinja_env.get_template(name)
+    app.run(host='0.0.0.0', port=5000,
+            debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file